@@ -22,20 +22,18 @@ from __future__ import print_function
 # useful routines from enigma.py <http://www.magwag.plus.com/jim/enigma.html>
 #
 
-from itertools import islice
-
-# iterate through iterable <l> in chunks of size <n>
-def chunk(s, n):
-  i = iter(s)
-  while True:
-    s = tuple(islice(i, 0, n))
-    if not len(s): break
-    yield s
+import random
+from bisect import bisect_left
+from collections import deque
 
 # flatten a list of lists
 def flatten(l):
   return list(j for i in l for j in i)
 
+# transpose grid <s> (in row major order, with rows of length <m>)
+def transpose(s, m):
+  return flatten(s[i::m] for i in range(m))
+
 
 #
 # the code to solve Enigma 1444 <http://enigmaticcode.wordpress.com/2013/04/06/enigma-1444-backslide/#comment-1957>
@@ -44,71 +42,133 @@ def flatten(l):
 
 class Impossible(Exception): pass
 
+# the cycle of moves that completes the top row of a 2x3 grid, once its
+# two tiles are staged in positions 3 and 0
+CYCLE2x3 = (0, 1, 3, 5, 4, 2, 0, 1, 3, 2, 4, 5, 3, 1, 0, 2)
+
 class Puzzle(object):
 
+  # adjacency tables, keyed by (m, n) and shared between puzzles
+  _adjacency = dict()
+
   def __init__(self, m, n, target, initial=None):
     assert m > 1 and n > 1
+    assert m * n <= 256, "grid too large"
     if initial is None: initial = list(range(1, m * n)) + [0]
     assert len(initial) == m * n, "invalid initial grid"
     assert len(target) == m * n and target[-1] == 0, "invalid target grid"
     # if m > n flip the puzzle around
     self.flipped = (m > n)
     if self.flipped:
-      target = flatten(zip(*chunk(target, m)))
-      initial = flatten(zip(*chunk(initial, m)))
+      target = transpose(target, m)
+      initial = transpose(initial, m)
       m, n = n, m
     self.m = m
     self.n = n
-    self.grid = list(initial)
-    self.target = list(target)
-    self.b = initial.index(0)
-    self.moves = []
+    # precompute the positions adjacent to each position
+    adj = Puzzle._adjacency.get((m, n))
+    if adj is None:
+      adj = list()
+      for p in range(m * n):
+        (p0, p1) = divmod(p, m)
+        a = []
+        if p0 > 0: a.append(p - m)
+        if p0 + 1 < n: a.append(p + m)
+        if p1 > 0: a.append(p - 1)
+        if p1 + 1 < m: a.append(p + 1)
+        adj.append(tuple(a))
+      Puzzle._adjacency[(m, n)] = adj = tuple(adj)
+    self._adj = adj
+    # the grids are kept as byte arrays (1 byte per tile), so that hot
+    # operations like index() run as C-level scans over a compact buffer
+    self.grid = bytearray(initial)
+    self.target = bytearray(target)
+    # reverse index: pos[t] is the position of tile <t> in the grid
+    # (tiles keep their original labels in a reduced puzzle, so the
+    # index is sized by the largest label, not the grid)
+    self.pos = bytearray(max(self.grid) + 1)
+    self._index()
+    self.b = self.pos[0]
+    # the moves are kept as two parallel byte arrays: the operations
+    # ('M' or 'P') and the tiles they apply to
+    self._ops = bytearray()
+    self._tiles = bytearray()
+    # indices of the 'M' entries in the move arrays (so the most recent
+    # move can be found without scanning)
+    self._mi = []
+    # position of the first unsolved square (rows above are solved in place)
+    self.base = 0
+
+  # the moves so far, as ('M'|'P', tile) pairs
+  def moves(self):
+    return zip(map(chr, self._ops), self._tiles)
+
+  # rebuild the tile -> position index from the grid
+  def _index(self):
+    pos = self.pos
+    for (p, t) in enumerate(self.grid): pos[t] = p
 
   # make a copy of this puzzle
   def copy(self):
     return Puzzle(self.m, self.n, self.target, self.grid)
 
+  # a compact hashable key for the current grid, suitable for use in a
+  # visited set or dict when searching over puzzle states; grids of up
+  # to 16 squares pack into a single integer (4 bits per square),
+  # larger grids are frozen to bytes
+  def key(self):
+    g = self.grid
+    if len(g) > 16: return bytes(g)
+    k = 0
+    for x in g: k = (k << 4) | x
+    return k
+
   # scramble the puzzle
   def scramble(self):
-    (g, m) = (self.grid, self.m)
-    import random
+    (g, m, pos) = (self.grid, self.m, self.pos)
     random.shuffle(g)
-    # count the number of inversions in the grid
-    i = sum(1 for i in range(len(g)) if g[i] > 0 for j in range(i + 1, len(g)) if g[j] > 0 and g[i] > g[j])
-    b = g.index(0)
+    self._index()
+    # count the number of inversions in the grid, by keeping the tiles seen
+    # so far in a sorted list and counting how many exceed each new tile
+    i = 0
+    seen = []
+    for x in g:
+      if x == 0: continue
+      j = bisect_left(seen, x)
+      i += len(seen) - j
+      seen.insert(j, x)
+    b = pos[0]
     # a puzzle with odd m always has even permutations, for even m it alternates with the row of b
     if (m % 2 == 1 and i % 2 == 1) or (m % 2 == 0 and ((i + b // m) % 2 == 0)):
       # swap two adjacent tiles to correct the parity
       (i, j) = sorted((0, 1, 2), key=lambda x: g[x])[1:3]
       (g[i], g[j]) = (g[j], g[i])
+      (pos[g[i]], pos[g[j]]) = (i, j)
     self.b = b
 
   # positions adjacent to <p>
   def adjacent(self, p):
-    (m, n) = (self.m, self.n)
-    (p0, p1) = divmod(p, m)
-    if p0 > 0: yield p - m
-    if p0 + 1 < n: yield p + m
-    if p1 > 0: yield p - 1
-    if p1 + 1 < m: yield p + 1
+    return self._adj[p]
 
   # move by sliding the tiles at positions <ps>
   def move(self, ps):
-    (b, g, ms) = (self.b, self.grid, self.moves)
+    (b, g, mi, pos) = (self.b, self.grid, self._mi, self.pos)
+    (ops, ts) = (self._ops, self._tiles)
     for p in ps:
       # check the blank is adjacent to position p
-      assert any(b == x for x in self.adjacent(p)), "invalid move"
-      # update moves
-      ms.append(('M', g[p]))
-      # swap the blank and the tile
-      g[b], g[p], b = g[p], g[b], p
-      # remove any duplicate moves
-      for i in range(len(ms) - 2, -1, -1):
-        if ms[i][0] == 'M':
-          if ms[i] == ms[-1]:
-            del ms[-1]
-            del ms[i]
-          break
+      assert b in self.adjacent(p), "invalid move"
+      t = g[p]
+      # swap the blank and the tile (updating the reverse index)
+      (g[b], g[p], pos[t], pos[0], b) = (t, 0, b, p, p)
+      # if this move just undoes the previous one the pair cancels out
+      if mi and ts[mi[-1]] == t:
+        i = mi.pop()
+        del ops[i]
+        del ts[i]
+      else:
+        ops += b'M'
+        ts.append(t)
+        mi.append(len(ops) - 1)
     # update blank position
     self.b = b
 
@@ -118,21 +178,32 @@ class Puzzle(object):
     (m, n, g, b) = (self.m, self.n, self.grid, self.b)
     # is the blank already in position?
     if b in ps: return
+    # is it just one move away? (then there is no need for a search)
+    a = self.adjacent(b)
+    qs = [p for p in ps if p in a and p not in fs]
+    if qs:
+      self.move([min(qs)])
+      return
     # an empty grid to record distances from the blank
     h = [None] * len(g)
-    # mark any fixed tiles
+    # mark any solved rows and fixed tiles
+    for p in range(self.base): h[p] = m + n
     for p in fs: h[p] = m + n
     # and the initial position of the blank
     h[b] = 0
-    # and propogate distances from the blank
-    d = 0
-    while h.count(d) > 0:
-      for (p, x) in enumerate(h):
-        if x != d: continue
-        # mark any adjacent empty squares with d + 1
-        for q in self.adjacent(p):
-          if h[q] is None: h[q] = d + 1
-      d += 1
+    # and propogate distances from the blank (breadth first)
+    # (everything the inner loop touches is a local variable)
+    adj = self._adj
+    q = deque([b])
+    (push, pop) = (q.append, q.popleft)
+    while q:
+      p = pop()
+      d = h[p] + 1
+      # mark any adjacent empty squares with the next distance
+      for x in adj[p]:
+        if h[x] is None:
+          h[x] = d
+          push(x)
     # find the position with a minimal distance
     (d, p) = min((h[p], p) for p in ps)
     # now traverse the grid to find the moves needed
@@ -140,7 +211,7 @@ class Puzzle(object):
     while d > 1:
       # find an adjacent square with a distance of d - 1
       d -= 1
-      for p in self.adjacent(p):
+      for p in adj[p]:
         if h[p] == d:
           ms.insert(0, p)
           break
@@ -151,10 +222,11 @@ class Puzzle(object):
   # without disturbing tiles in positions <fs>
   # (presumed to be in the top row on the left)
   def place(self, t, p, fs):
-    self.moves.append(('P', t))
-    (g, m) = (self.grid, self.m)
+    self._ops += b'P'
+    self._tiles.append(t)
+    m = self.m
     # find the tile
-    s = g.index(t)
+    s = self.pos[t]
     # move the piece to the right (if necessary)
     while s % m < p % m:
       self.blank([s + 1], fs + [s])
@@ -171,78 +243,92 @@ class Puzzle(object):
       self.move([s])
       s -= 1
 
-  # solve a reduced puzzle by removing the top row
+  # solve the remaining rows as a separate (flipped) puzzle
   def reduce(self):
-    (m, n, g, t) = (self.m, self.n, self.grid, self.target)
-    # create a reduced puzzle
-    p = Puzzle(m, n - 1, t[m:], initial=g[m:])
+    (m, g, t, o) = (self.m, self.grid, self.target, self.base)
+    # create a reduced puzzle from the unsolved rows
+    p = Puzzle(m, self.n - o // m, t[o:], initial=g[o:])
     # solve it
     p.solve()
     # and incorporate the results (unflipping as necessary)
-    if p.flipped: p.grid = flatten(zip(*chunk(p.grid, p.m)))
-    self.grid = self.grid[:m] + p.grid
-    self.b = self.grid.index(0)
-    self.moves.extend(p.moves)
-
-  # solve a 2x2 grid
+    if p.flipped: p.grid = bytearray(transpose(p.grid, p.m))
+    self.grid = g[:o] + p.grid
+    self._index()
+    self.b = self.pos[0]
+    k = len(self._ops)
+    self._ops += p._ops
+    self._tiles += p._tiles
+    self._mi.extend(k + i for i in p._mi)
+
+  # solve a remaining 2x2 grid
   def solve2x2(self):
+    o = self.base
     # place the right tile in position 0
-    self.place(self.target[0], 0, [])
+    self.place(self.target[o], o, [])
     # and the blank in the bottom right
-    self.blank([3], [0])
+    self.blank([o + 3], [o])
     # is it solved?
     if self.grid != self.target: raise Impossible
 
-  # solve a 2x3 grid
+  # solve the top row of a remaining 2x3 grid
   def solve2x3(self):
-    t = self.target
+    (t, o) = (self.target, self.base)
     # place the right tile in position 0
-    self.place(t[0], 0, [])
+    self.place(t[o], o, [])
     # if the next tile is not already in position
-    if self.grid.index(t[1]) != 1:
+    if self.pos[t[o + 1]] != o + 1:
       # get the tile for position 1 in position 3
-      self.place(t[1], 3, [0])
+      self.place(t[o + 1], o + 3, [o])
       # if the blank is in position 1, just move the piece into place
-      if self.b == 1:
-        self.move([3])
+      if self.b == o + 1:
+        self.move([o + 3])
       else:
         # get the blank into position 2 and then move the piece into position
-        self.blank([2], [0, 3])
-        self.move([0, 1, 3, 5, 4, 2, 0, 1, 3, 2, 4, 5, 3, 1, 0, 2])
-    # and solve the remaining 2x2 grid
-    self.reduce()
+        self.blank([o + 2], [o, o + 3])
+        self.move(o + x for x in CYCLE2x3)
 
-  # general case solver for larger grids
+  # solve the top unsolved row in place
   def solveit(self):
-    (m, n, t) = (self.m, self.n, self.target)
+    (m, t, o) = (self.m, self.target, self.base)
     # get the first m - 1 tiles in the right position
     fs = []
-    for i in range(0, m - 1):
-      self.place(t[i], i, fs)
+    for i in range(o, o + m - 1):
+      # (skipping any tile that is already in position)
+      if self.grid[i] != t[i]: self.place(t[i], i, fs)
       fs.append(i)
     # if the final tile of the row is not in position
-    if self.grid.index(t[m - 1]) != m - 1:
+    if self.pos[t[o + m - 1]] != o + m - 1:
       # then get it underneath it's target position
-      p = m - 3
-      self.place(t[m - 1], p + 2 + m, fs)
+      p = o + m - 3
+      self.place(t[o + m - 1], p + 2 + m, fs)
       # get the blank in the right position and complete the top row
       if self.b == p + 2:
         self.move([p + 2 + m])
       else:
         self.blank([p + m], fs + [p + 2 + m])
         self.move((p + x for x in (0, 1, 2, 2 + m, 1 + m, 1, 0, m)))
-    # and solve the rest of the puzzle
-    self.reduce()
 
   def solve(self):
-    (m, n) = (self.m, self.n)
-    if (m, n) == (2, 2):
-      self.solve2x2()
-    elif (m, n) == (2, 3):
-      self.solve2x3()
-    else:
-      self.solveit()
-    return self.moves
+    m = self.m
+    # solve the grid one row at a time, in place, without building a new
+    # puzzle per row; a sub-puzzle is only created when the unsolved rows
+    # need to be flipped around
+    while True:
+      # height of the unsolved portion of the grid
+      n = self.n - self.base // m
+      if (m, n) == (2, 2):
+        self.solve2x2()
+        break
+      elif (m, n) == (2, 3):
+        self.solve2x3()
+      elif m > n:
+        # the unsolved portion is wider than it is tall, flip it around
+        self.reduce()
+        break
+      else:
+        self.solveit()
+      self.base += m
+    return self.moves()
 
 
 #
@@ -275,8 +361,9 @@ class App(Frame):
 
   def __init__(self):
     self.moving = None
+    self.frames = deque()
     self.count = 0
-    self.moves = []
+    self.moves = iter(())
     self.current_tile = None
     self.placed_tiles = set()
     self.current_position = None
@@ -290,6 +377,8 @@ class App(Frame):
     if len(t) < self.m * self.n: t += [0]
     self.target_args = (t if len(args.t) > 0 else None)
     self.puzzle = Puzzle(self.m, self.n, t, list(range(1, self.m * self.n)) + [0])
+    # map each tile to its position in the target
+    self.target_map = dict((t, p) for (p, t) in enumerate(self.puzzle.target))
     self.fg = args.fg
     self.bg = args.bg
     self.hl = args.hl
@@ -389,6 +478,7 @@ class App(Frame):
     # compute the size of a tile
     (x0, y0, frame, border) = (self.padx, self.pady, self.frame, self.border)
     tile = min((cw - 2 * (x0 + frame) - (self.m + 1) * border) // self.m, (ch - 2 * (y0 + frame) - (self.n + 1) * border) // self.n)
+    self.tile = tile
     x0 = (cw - 2 * frame - self.m * (border + tile) - border) // 2
     y0 = (ch - 2 * frame - self.n * (border + tile) - border) // 2
     font = [self.font, tile // 2, 'bold']
@@ -421,8 +511,8 @@ class App(Frame):
       (i, j) = self.flip(divmod(self.moving, self.puzzle.m))
       (x, y) = (x0 + j * (tile + border) + border, y0 + i * (tile + border) + border)
       (xo, yo) = (tile * self.offset[0] * self.offset[2] // self.steps, tile * self.offset[1] * self.offset[2] // self.steps)
-      self.canvas.create_rectangle(x + xo + 1, y + yo + 1, x + tile + xo - 1, y + tile + yo - 1, outline=self.fg, fill=self.fill(t), width=2)
-      self.canvas.create_text(x + tile // 2 + xo, y + tile // 2 + yo, text=t, font=font)
+      self.canvas.create_rectangle(x + xo + 1, y + yo + 1, x + tile + xo - 1, y + tile + yo - 1, outline=self.fg, fill=self.fill(t), width=2, tags='moving')
+      self.canvas.create_text(x + tile // 2 + xo, y + tile // 2 + yo, text=t, font=font, tags='moving')
 
   # move the tile at position p
   def move(self, p):
@@ -433,26 +523,34 @@ class App(Frame):
     if self.puzzle.b == p + 1: (x, y) = (1, 0)
     if self.puzzle.b == p - 1: (x, y) = (-1, 0)
     self.offset = list(self.flip((x, y))) + [0]
-    # set a timer to update the offset
+    # draw the tile in its starting position
+    self.draw()
+    # precompute the pixel nudge for each animation frame
+    (ox, oy, _) = self.offset
+    (tile, steps) = (self.tile, self.steps)
+    self.frames = deque(
+      ((tile * ox * k) // steps - (tile * ox * (k - 1)) // steps,
+       (tile * oy * k) // steps - (tile * oy * (k - 1)) // steps)
+      for k in range(1, steps + 1))
+    # set a timer to play the frames
     self.after(self.delay, self.slide)
 
   def automate(self, moves):
-    while len(moves) > 0:
-      m = moves.pop(0)
+    self.moves = moves
+    for m in moves:
       if m[0] == 'M':
-        self.move(self.puzzle.grid.index(m[1]))
-        break
+        self.move(self.puzzle.pos[m[1]])
+        return
       elif m[0] == 'P':
         if self.current_tile is not None:
           self.placed_tiles.add(self.current_tile)
         self.current_tile = m[1]
-        self.current_position = self.puzzle.target.index(self.current_tile)
-    if len(moves) == 0:
-      self.current_tile = self.current_position = None
-      self.placed_tiles = set()
-      self.set_message()
-      self.stop()
-    self.moves = moves
+        self.current_position = self.target_map[self.current_tile]
+    # all the moves have been played
+    self.current_tile = self.current_position = None
+    self.placed_tiles = set()
+    self.set_message()
+    self.stop()
 
   def set_message(self):
     elapsed = (0 if self.start_time is None else int(time.time() - self.start_time))
@@ -461,16 +559,19 @@ class App(Frame):
     self.message.set("{state}Moves: {n}, Elapsed Time: {m:1d}m{s:02d}s".format(state=state, n=self.count, m=m, s=s))
 
   def slide(self):
-    if self.offset[2] < self.steps:
+    if self.frames:
+      (dx, dy) = self.frames.popleft()
       self.offset[2] += 1
       self.after(self.delay, self.slide)
+      # only the moving tile changes, so just nudge it along
+      self.canvas.move('moving', dx, dy)
     else:
       self.puzzle.move([self.moving])
       self.moving = None
       self.automate(self.moves)
       self.count += 1
       self.set_message()
-    self.draw()
+      self.draw()
 
   def click(self, event):
     w = event.widget.find_withtag(CURRENT)
@@ -480,7 +581,6 @@ class App(Frame):
         p = int(tag[4:])
         if self.start_time is None: self.start_time = time.time()
         self.move(p)
-    self.draw()
 
   def scramble(self):
     self.puzzle.scramble()
@@ -496,7 +596,8 @@ class App(Frame):
       target = list(range(self.m * self.n - 1, 0, -1)) + [0]
     if value == 'Target: Command Line':
       target = self.target_args
-    self.puzzle.target = (flatten(zip(*chunk(target, self.m))) if self.puzzle.flipped else target)
+    self.puzzle.target = bytearray(transpose(target, self.m) if self.puzzle.flipped else target)
+    self.target_map = dict((t, p) for (p, t) in enumerate(self.puzzle.target))
     self.set_message()
     self.draw()
 
@@ -514,7 +615,7 @@ class App(Frame):
       self.bell()
 
   def stop(self):
-    self.moves = []
+    self.moves = iter(())
     self.solve_button.configure(text='Solve', command=self.solve)
 
 